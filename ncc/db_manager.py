@@ -1,4 +1,6 @@
 import sqlite3
+import threading
+import time
 from contextlib import contextmanager
 import logging
 from typing import List, Dict, Optional
@@ -24,7 +26,17 @@ class DatabaseManager:
             self.db_path = os.path.join(data_dir, "ncc_data.db")
         else:
             self.db_path = db_path
-            
+
+        # 每个线程一条持久连接：消息线程和转发线程各自复用，
+        # 不再为每次查询付一遍 sqlite3_open + 解析schema 的开销
+        self._local = threading.local()
+
+        # 高频只读结果的短TTL缓存：管理员/迎新群数据只在Notion同步后变化，
+        # 每条入群消息、每次权限判断不必都跑SQL
+        self._read_cache: Dict[str, tuple] = {}
+        self._cache_lock = threading.Lock()
+        self._CACHE_TTL = 30  # 秒
+
         self._init_db()
 
     def _init_db(self):
@@ -99,7 +111,8 @@ class DatabaseManager:
             # 创建索引
             cur.execute('CREATE INDEX IF NOT EXISTS idx_group_lists_group ON group_lists(group_wxid)')
             cur.execute('CREATE INDEX IF NOT EXISTS idx_group_lists_list ON group_lists(list_id)')
-            cur.execute('CREATE INDEX IF NOT EXISTS idx_welcome_messages_group ON welcome_messages(group_wxid)')
+            # 复合索引同时服务 WHERE group_wxid = ? 和 ORDER BY id，免去临时排序
+            cur.execute('CREATE INDEX IF NOT EXISTS idx_welcome_messages_group_id ON welcome_messages(group_wxid, id)')
             
             # 关键词表
             cur.execute('''
@@ -115,81 +128,207 @@ class DatabaseManager:
             
             # 创建关键词索引
             cur.execute('CREATE INDEX IF NOT EXISTS idx_keywords_keyword ON keywords(keyword)')
-            
+
+            # 转发结果日志表：调限流速率、排查漏发时用
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS forward_log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    msg_id INTEGER NOT NULL,
+                    group_wxid TEXT NOT NULL,
+                    success INTEGER NOT NULL,
+                    retries INTEGER DEFAULT 0,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
             conn.commit()
 
+    def _get_conn(self) -> sqlite3.Connection:
+        """获取当前线程的持久连接，首次使用时创建并配置PRAGMA"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # cached_statements 调大一些：连接常驻后，语句缓存命中才真正省掉解析
+            conn = sqlite3.connect(self.db_path, cached_statements=256)
+            # WAL 让转发线程写日志时不阻塞消息线程的读查询；
+            # NORMAL 同步配合WAL已经足够安全，其余是常规的缓存/锁等待调优
+            cur = conn.cursor()
+            cur.execute('PRAGMA journal_mode=WAL')
+            cur.execute('PRAGMA synchronous=NORMAL')
+            cur.execute('PRAGMA busy_timeout=5000')
+            cur.execute('PRAGMA temp_store=MEMORY')
+            cur.execute('PRAGMA cache_size=-20000')
+            cur.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    def _get_read_conn(self) -> sqlite3.Connection:
+        """获取当前线程的只读连接，首次使用时创建
+
+        WAL 下只读连接不会拿写锁，管理菜单的查询不会排在
+        转发线程的写事务后面。
+        """
+        conn = getattr(self._local, "read_conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, cached_statements=256)
+            cur = conn.cursor()
+            cur.execute('PRAGMA busy_timeout=5000')
+            cur.execute('PRAGMA cache_size=-20000')
+            self._local.read_conn = conn
+        return conn
+
+    @contextmanager
+    def get_reader(self):
+        """只读查询专用的连接上下文管理器"""
+        yield self._get_read_conn()
+
+    def close(self) -> None:
+        """关闭当前线程的连接，顺带让SQLite整理统计信息"""
+        read_conn = getattr(self._local, "read_conn", None)
+        if read_conn is not None:
+            read_conn.close()
+            self._local.read_conn = None
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            try:
+                conn.execute('PRAGMA optimize')
+            finally:
+                conn.close()
+                self._local.conn = None
+
+    def _cached(self, key: str, loader):
+        """按键名做TTL缓存，miss时调用loader取数"""
+        now = time.monotonic()
+        with self._cache_lock:
+            hit = self._read_cache.get(key)
+            if hit and now - hit[0] <= self._CACHE_TTL:
+                return hit[1]
+        value = loader()
+        with self._cache_lock:
+            self._read_cache[key] = (now, value)
+        return value
+
+    def invalidate_cache(self) -> None:
+        """清空只读缓存（Notion 同步落库后调用）"""
+        with self._cache_lock:
+            self._read_cache.clear()
+
     @contextmanager
     def get_db(self):
-        """获取数据库连接的上下文管理器"""
+        """获取数据库连接的上下文管理器
+
+        连接按线程复用、不在退出时关闭，调用方的
+        `with self.db.get_db() as conn:` 写法保持不变。
+        """
+        yield self._get_conn()
+
+    @contextmanager
+    def bulk_mode(self):
+        """批量写入专用连接：用宽松的持久化设置换写入速度
+
+        只用于可以整体重跑的全量导入（比如 Notion 同步），中途失败时
+        重新同步一次即可，所以可以关掉每次提交的fsync。
+        """
         conn = sqlite3.connect(self.db_path)
         try:
+            cur = conn.cursor()
+            # 库整体运行在WAL下，这里不再切journal_mode（那是库级设置），
+            # 只放宽本连接的fsync
+            cur.execute('PRAGMA synchronous=OFF')
+            cur.execute('PRAGMA busy_timeout=5000')
+            cur.execute('PRAGMA temp_store=MEMORY')
             yield conn
         finally:
             conn.close()
 
-    def update_groups(self, groups: List[Dict]):
+    @contextmanager
+    def _write_conn(self, conn=None):
+        """写操作的连接：外部传入则复用（批量模式），否则新开一个"""
+        if conn is not None:
+            yield conn
+        else:
+            with self.get_db() as new_conn:
+                yield new_conn
+
+    @staticmethod
+    def _apply_groups(cur, groups: List[Dict]):
+        """群组及其列表关联的批量写入（不提交，调用方控制事务）"""
+        cur.executemany('''
+            INSERT OR REPLACE INTO groups 
+            (wxid, name, welcome_enabled, allow_forward, allow_speak, welcome_url, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (
+            (
+                group['wxid'], 
+                group['name'],
+                1 if group.get('welcome_enabled', 0) else 0,  # 确保布尔值被正确转换为整数
+                1 if group.get('allow_forward', 0) else 0,
+                1 if group.get('allow_speak', 0) else 0,
+                group.get('welcome_url')
+            )
+            for group in groups
+        ))
+        # 更新群组的列表关联：先删旧关联，再整批插入新关联
+        with_lists = [g for g in groups if 'list_ids' in g]
+        cur.executemany(
+            'DELETE FROM group_lists WHERE group_wxid = ?',
+            ((g['wxid'],) for g in with_lists)
+        )
+        cur.executemany('''
+            INSERT INTO group_lists (group_wxid, list_id, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+        ''', (
+            (g['wxid'], list_id)
+            for g in with_lists
+            for list_id in g['list_ids']
+            if list_id is not None
+        ))
+
+    def update_groups(self, groups: List[Dict], conn=None):
         """更新群组信息，使用事务确保原子性"""
-        with self.get_db() as conn:
+        with self._write_conn(conn) as conn:
             try:
-                cur = conn.cursor()
-                for group in groups:
-                    # 更新群组基本信息
-                    cur.execute('''
-                        INSERT OR REPLACE INTO groups 
-                        (wxid, name, welcome_enabled, allow_forward, allow_speak, welcome_url, updated_at)
-                        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                    ''', (
-                        group['wxid'], 
-                        group['name'],
-                        1 if group.get('welcome_enabled', 0) else 0,  # 确保布尔值被正确转换为整数
-                        1 if group.get('allow_forward', 0) else 0,
-                        1 if group.get('allow_speak', 0) else 0,
-                        group.get('welcome_url')
-                    ))
-                    
-                    # 更新群组的列表关联
-                    if 'list_ids' in group:
-                        # 先删除该群组的所有列表关联
-                        cur.execute('DELETE FROM group_lists WHERE group_wxid = ?', (group['wxid'],))
-                        # 添加新的列表关联
-                        for list_id in group['list_ids']:
-                            if list_id is not None:
-                                cur.execute('''
-                                    INSERT INTO group_lists (group_wxid, list_id, updated_at)
-                                    VALUES (?, ?, CURRENT_TIMESTAMP)
-                                ''', (group['wxid'], list_id))
+                self._apply_groups(conn.cursor(), groups)
                 conn.commit()
             except Exception as e:
                 conn.rollback()
                 logger.error(f"更新群组信息失败: {e}")
                 raise
 
-    def update_forward_lists(self, lists: List[Dict]):
+    @staticmethod
+    def _apply_forward_lists(cur, lists: List[Dict]):
+        """转发列表的批量写入（不提交，调用方控制事务）"""
+        cur.executemany('''
+            INSERT OR REPLACE INTO forward_lists (list_id, list_name, description, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (
+            (lst['list_id'], lst['list_name'], lst.get('description', ''))
+            for lst in lists
+        ))
+
+    def update_forward_lists(self, lists: List[Dict], conn=None):
         """更新转发列表信息，使用事务确保原子性"""
-        with self.get_db() as conn:
+        with self._write_conn(conn) as conn:
             try:
-                cur = conn.cursor()
-                for lst in lists:
-                    cur.execute('''
-                        INSERT OR REPLACE INTO forward_lists (list_id, list_name, description, updated_at)
-                        VALUES (?, ?, ?, CURRENT_TIMESTAMP)
-                    ''', (lst['list_id'], lst['list_name'], lst.get('description', '')))
+                self._apply_forward_lists(conn.cursor(), lists)
                 conn.commit()
             except Exception as e:
                 conn.rollback()
                 logger.error(f"更新转发列表失败: {e}")
                 raise
 
-    def update_admins(self, admins: List[Dict]):
+    @staticmethod
+    def _apply_admins(cur, admins: List[Dict]):
+        """管理员的批量写入（不提交，调用方控制事务）"""
+        cur.executemany('''
+            INSERT OR REPLACE INTO admins (wxid, name, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+        ''', ((admin['wxid'], admin['name']) for admin in admins))
+
+    def update_admins(self, admins: List[Dict], conn=None):
         """更新管理员信息，使用事务确保原子性"""
-        with self.get_db() as conn:
+        with self._write_conn(conn) as conn:
             try:
-                cur = conn.cursor()
-                for admin in admins:
-                    cur.execute('''
-                        INSERT OR REPLACE INTO admins (wxid, name, updated_at)
-                        VALUES (?, ?, CURRENT_TIMESTAMP)
-                    ''', (admin['wxid'], admin['name']))
+                self._apply_admins(conn.cursor(), admins)
                 conn.commit()
             except Exception as e:
                 conn.rollback()
@@ -198,7 +337,7 @@ class DatabaseManager:
 
     def get_groups_by_list_id(self, list_id: int) -> List[str]:
         """获取指定列表ID的所有群组wxid"""
-        with self.get_db() as conn:
+        with self.get_reader() as conn:
             cur = conn.cursor()
             cur.execute('''
                 SELECT g.wxid 
@@ -206,25 +345,38 @@ class DatabaseManager:
                 JOIN group_lists gl ON g.wxid = gl.group_wxid
                 WHERE gl.list_id = ?
             ''', (list_id,))
-            return [row[0] for row in cur.fetchall()]
+            return [row[0] for row in cur]
 
-    def get_admin_wxids(self) -> List[str]:
-        """获取所有管理员的wxid"""
-        with self.get_db() as conn:
+    def get_admin_wxids(self) -> frozenset:
+        """获取所有管理员的wxid（带TTL缓存）
+
+        返回 frozenset：成员判断O(1)，而且不可变，缓存值可以
+        放心地在多个线程之间共享。
+        """
+        return self._cached('admin_wxids', self._load_admin_wxids)
+
+    def _load_admin_wxids(self) -> frozenset:
+        with self.get_reader() as conn:
             cur = conn.cursor()
             cur.execute('SELECT wxid FROM admins')
-            return [row[0] for row in cur.fetchall()]
+            return frozenset(row[0] for row in cur)
 
     def get_admin_names(self) -> List[str]:
-        """获取所有管理员的名称"""
-        with self.get_db() as conn:
+        """获取所有管理员的名称（带TTL缓存）"""
+        return self._cached('admin_names', self._load_admin_names)
+
+    def _load_admin_names(self) -> List[str]:
+        with self.get_reader() as conn:
             cur = conn.cursor()
             cur.execute('SELECT name FROM admins')
-            return [row[0] for row in cur.fetchall()]
+            return [row[0] for row in cur]
 
     def get_welcome_enabled_groups(self) -> List[Dict]:
-        """获取所有启用迎新消息的群组"""
-        with self.get_db() as conn:
+        """获取所有启用迎新消息的群组（带TTL缓存，每条入群消息都会查）"""
+        return self._cached('welcome_groups', self._load_welcome_enabled_groups)
+
+    def _load_welcome_enabled_groups(self) -> List[Dict]:
+        with self.get_reader() as conn:
             cur = conn.cursor()
             cur.execute('''
                 SELECT wxid, name, welcome_enabled 
@@ -237,12 +389,12 @@ class DatabaseManager:
                     'name': row[1],
                     'welcome_enabled': row[2]
                 }
-                for row in cur.fetchall()
+                for row in cur
             ]
 
     def get_welcome_messages(self, group_wxid: str) -> List[Dict]:
         """获取指定群的迎新消息"""
-        with self.get_db() as conn:
+        with self.get_reader() as conn:
             cur = conn.cursor()
             cur.execute('''
                 SELECT message_type, content, extra
@@ -256,7 +408,7 @@ class DatabaseManager:
                     'content': row[1],
                     'extra': row[2]
                 }
-                for row in cur.fetchall()
+                for row in cur
             ]
 
     def save_welcome_messages(self, group_wxid: str, messages: List[Dict], operator: str):
@@ -272,19 +424,15 @@ class DatabaseManager:
                 cur = conn.cursor()
                 # 先删除原有的消息
                 cur.execute('DELETE FROM welcome_messages WHERE group_wxid = ?', (group_wxid,))
-                # 插入新的消息
-                for msg in messages:
-                    cur.execute('''
-                        INSERT INTO welcome_messages 
-                        (group_wxid, message_type, content, extra, operator)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (
-                        group_wxid,
-                        msg['type'],
-                        msg.get('content'),
-                        msg.get('extra'),
-                        operator
-                    ))
+                # 一次性批量插入新的消息，整批只提交一次
+                cur.executemany('''
+                    INSERT INTO welcome_messages
+                    (group_wxid, message_type, content, extra, operator)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', (
+                    (group_wxid, msg['type'], msg.get('content'), msg.get('extra'), operator)
+                    for msg in messages
+                ))
                 conn.commit()
             except Exception as e:
                 conn.rollback()
@@ -293,7 +441,7 @@ class DatabaseManager:
 
     def get_welcome_url(self, group_id: str) -> Optional[str]:
         """获取群的欢迎小卡片URL"""
-        with self.get_db() as conn:
+        with self.get_reader() as conn:
             cur = conn.cursor()
             cur.execute('SELECT welcome_url FROM groups WHERE wxid = ?', (group_id,))
             result = cur.fetchone()
@@ -318,7 +466,7 @@ class DatabaseManager:
 
     def get_admin_name_by_wxid(self, wxid: str) -> Optional[str]:
         """根据wxid获取管理员昵称"""
-        with self.get_db() as conn:
+        with self.get_reader() as conn:
             cur = conn.cursor()
             cur.execute('SELECT name FROM admins WHERE wxid = ?', (wxid,))
             result = cur.fetchone()
@@ -326,7 +474,7 @@ class DatabaseManager:
 
     def get_speak_enabled_groups(self) -> List[Dict]:
         """获取所有允许发言的群组"""
-        with self.get_db() as conn:
+        with self.get_reader() as conn:
             cur = conn.cursor()
             cur.execute('''
                 SELECT wxid, name, welcome_enabled, allow_forward, allow_speak
@@ -341,31 +489,71 @@ class DatabaseManager:
                     'allow_forward': row[3],
                     'allow_speak': row[4]
                 }
-                for row in cur.fetchall()
+                for row in cur
             ]
 
-    def update_keywords(self, keywords_data: List[Dict]):
+    @staticmethod
+    def _apply_keywords(cur, keywords_data: List[Dict]):
+        """关键词的批量写入：清空重建（不提交，调用方控制事务）"""
+        cur.execute('DELETE FROM keywords')
+        cur.executemany('''
+            INSERT INTO keywords (keyword, group_id, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+        ''', ((item['keyword'], item['group_id']) for item in keywords_data))
+
+    def update_keywords(self, keywords_data: List[Dict], conn=None):
         """更新关键词数据，使用事务确保原子性"""
-        with self.get_db() as conn:
+        with self._write_conn(conn) as conn:
             try:
-                cur = conn.cursor()
-                # 先清空旧数据
-                cur.execute('DELETE FROM keywords')
-                # 插入新数据
-                for item in keywords_data:
-                    cur.execute('''
-                        INSERT INTO keywords (keyword, group_id, updated_at)
-                        VALUES (?, ?, CURRENT_TIMESTAMP)
-                    ''', (item['keyword'], item['group_id']))
+                self._apply_keywords(conn.cursor(), keywords_data)
                 conn.commit()
             except Exception as e:
                 conn.rollback()
                 logger.error(f"更新关键词数据失败: {e}")
                 raise
 
+    def bulk_update(self, lists: List[Dict], groups: List[Dict],
+                    admins: List[Dict], keywords: List[Dict]):
+        """Notion 全量同步落库：四张表在同一个事务里写完
+
+        整批只提交一次，失败时整体回滚，不会留下半套数据。
+        """
+        with self.bulk_mode() as conn:
+            try:
+                cur = conn.cursor()
+                self._apply_forward_lists(cur, lists)
+                self._apply_groups(cur, groups)
+                self._apply_admins(cur, admins)
+                self._apply_keywords(cur, keywords)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error("批量同步数据失败: %s", e)
+                raise
+
+    def log_forward_results(self, rows: List[tuple]):
+        """批量写入转发结果日志
+
+        Args:
+            rows: (msg_id, group_wxid, success, retries) 元组列表，
+                  整批一个事务提交，fsync 只付一次
+        """
+        if not rows:
+            return
+        with self.get_db() as conn:
+            try:
+                conn.executemany('''
+                    INSERT INTO forward_log (msg_id, group_wxid, success, retries)
+                    VALUES (?, ?, ?, ?)
+                ''', rows)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.error("写入转发日志失败: %s", e)
+
     def get_groups_by_keyword(self, keyword: str) -> List[str]:
         """根据关键词获取对应的群组wxid列表"""
-        with self.get_db() as conn:
+        with self.get_reader() as conn:
             cur = conn.cursor()
             cur.execute('SELECT group_id FROM keywords WHERE keyword = ?', (keyword,))
-            return [row[0] for row in cur.fetchall()] 
\ No newline at end of file
+            return [row[0] for row in cur] 
\ No newline at end of file
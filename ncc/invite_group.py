@@ -1,6 +1,7 @@
 import logging
 import json
 import os
+import time
 from typing import Dict, List, Optional
 from wcferry import Wcf
 from .notion_manager import NotionManager
@@ -10,25 +11,56 @@ logger = logging.getLogger(__name__)
 
 class InviteService:
     """关键词邀请入群服务"""
-    
+
     def __init__(self, wcf: Wcf, notion_manager: NotionManager):
         self.wcf = wcf
         self.notion_manager = notion_manager
         self.db = notion_manager.db
-        
+        self._keyword_map: Dict[str, List[str]] = {}
+        self.refresh_keywords()
+        # 后台线程定期重建索引，消息线程只读内存字典，不被数据库IO阻塞
+        Thread(target=self._sync_loop, name="KeywordSync", daemon=True).start()
+
+    def _sync_loop(self, interval: int = 300) -> None:
+        """后台定期刷新关键词索引
+
+        refresh_keywords 整体替换 self._keyword_map（属性赋值是原子的），
+        读线程看到的要么是旧字典要么是新字典，不需要加锁。
+        """
+        while True:
+            time.sleep(interval)
+            self.refresh_keywords()
+
+    def refresh_keywords(self) -> None:
+        """从数据库一次性加载关键词到内存索引
+
+        每条消息都会走到 handle_keyword，把关键词查询换成内存字典，
+        避免每条消息都打开数据库查一次。同步 Notion 数据后需要重新调用。
+        """
+        try:
+            keyword_map: Dict[str, List[str]] = {}
+            with self.db.get_db() as conn:
+                cur = conn.cursor()
+                cur.execute('SELECT keyword, group_id FROM keywords')
+                for keyword, group_id in cur.fetchall():
+                    keyword_map.setdefault(keyword, []).append(group_id)
+            self._keyword_map = keyword_map
+        except Exception as e:
+            logger.error("加载关键词索引失败: %s", e)
+
     def handle_keyword(self, keyword: str, user_wxid: str) -> bool:
         """处理关键词并邀请用户
-        
+
         Args:
             keyword: 触发的关键词
             user_wxid: 用户的wxid
-            
+
         Returns:
             是否成功处理
         """
         try:
             # 获取目标群组
-            target_groups = self.db.get_groups_by_keyword(keyword)
+            target_groups = self._keyword_map.get(keyword)
             if not target_groups:
                 return False
             
@@ -38,15 +70,15 @@ class InviteService:
                     try:
                         result = self.wcf.invite_chatroom_members(group_id, user_wxid)
                         if result:
-                            logger.info(f"成功邀请用户 {user_wxid} 到群 {group_id}")
+                            logger.info("成功邀请用户 %s 到群 %s", user_wxid, group_id)
                         else:
-                            logger.error(f"邀请用户 {user_wxid} 到群 {group_id} 失败")
+                            logger.error("邀请用户 %s 到群 %s 失败", user_wxid, group_id)
                     except Exception as e:
-                        logger.error(f"邀请用户到群 {group_id} 时发生错误: {e}")
+                        logger.error("邀请用户到群 %s 时发生错误: %s", group_id, e)
                         
             Thread(target=do_invite, name="GroupInvite", daemon=True).start()
             return True
             
         except Exception as e:
-            logger.error(f"处理关键词邀请失败: {e}")
+            logger.error("处理关键词邀请失败: %s", e)
             return False 
\ No newline at end of file
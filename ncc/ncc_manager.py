@@ -1,5 +1,5 @@
 from typing import Optional, List, Dict
-from enum import Enum
+from enum import IntEnum
 from .notion_manager import NotionManager
 import logging
 import time
@@ -7,32 +7,118 @@ import random
 from configuration import Configuration as Config
 import os
 from wcferry import WxMsg
-from threading import Lock
 from datetime import datetime, timedelta
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from functools import lru_cache
 from queue import Queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
 from .welcome_service import WelcomeService
 from .db_manager import DatabaseManager
 
 logger = logging.getLogger(__name__)
 
-class ForwardState(Enum):
-    IDLE = "idle"
-    WAITING_CHOICE_MODE = "waiting_choice_mode"
-    WAITING_MESSAGE = "waiting_message"
-    WAITING_CHOICE = "waiting_choice"
-    WELCOME_MANAGE = "welcome_manage"  # 迎新消息管理状态
-    WELCOME_GROUP_CHOICE = "welcome_group_choice"  # 选择要管理迎新消息的群
-    WELCOME_COLLECTING = "welcome_collecting"  # 收集新的迎新消息
+# 静态菜单和提示文案：每次交互都会发送，提前拼好，不在热路径里重复拼接
+_MENU_TEXT = (
+    "NCC社群管理：\n"
+    "请回复指定数字\n"
+    "1 👈 转发消息\n"
+    "2 👈 同步 Notion 更改\n"
+    "3 👈 查看 Notion 后台\n"
+    "4 👈 查看团队成员\n"
+    "5 👈 迎新消息管理\n"
+    "0 👈 退出管理模式"
+)
+_FORWARD_PROMPT = (
+    "请发送需要转发的内容，支持公众号、推文、视频号、文字、图片、合并消息，一个一个来\n"
+    "发送【1】进入下一步\n"
+    "随时发送【0】退出转发模式"
+)
+_NOTION_LINK_TEXT = "列表信息，请登陆查看：https://www.notion.so/bigsong/NCC-1564e93f5682805d9a2ff0519c24738b?pvs=4"
+# 转发结果模板：每个任务只格式化一次，不在任务结束时重新拼接固定文字
+_STATUS_OK_TMPL = "转发完成！%d 条消息已发送到 %d 个群，耗时 %.0f 秒"
+_STATUS_TMPL = "转发完成！\n成功：%d 条\n失败：%d 条\n总计：%d 条消息到 %d 个群"
 
-@dataclass
+# 热路径SQL固定成常量：连接常驻后，SQLite按语句文本缓存预编译结果，
+# 文本逐字节一致才能命中缓存
+_SQL_FORWARD_LISTS = '''
+    SELECT list_id, list_name, description
+    FROM forward_lists
+    ORDER BY list_id
+'''
+_SQL_GROUPS_ALL = '''
+    SELECT DISTINCT g.wxid, g.name
+    FROM groups g
+    JOIN group_lists gl ON g.wxid = gl.group_wxid
+    WHERE g.allow_forward = 1
+    ORDER BY g.wxid
+'''
+_SQL_GROUPS_BY_LISTS = '''
+    SELECT DISTINCT g.wxid, g.name
+    FROM groups g
+    JOIN group_lists gl ON g.wxid = gl.group_wxid
+    WHERE gl.list_id IN ({placeholders})
+    AND g.allow_forward = 1
+    ORDER BY g.wxid
+'''
+# 按IN子句参数个数缓存拼好的SQL文本：同一份文本才能命中语句缓存
+_sql_groups_by_arity: Dict[int, str] = {}
+
+
+def _groups_sql(arity: int) -> str:
+    sql = _sql_groups_by_arity.get(arity)
+    if sql is None:
+        sql = _SQL_GROUPS_BY_LISTS.format(placeholders=','.join('?' * arity))
+        _sql_groups_by_arity[arity] = sql
+    return sql
+
+class TokenBucket:
+    """线程安全的令牌桶限流器
+
+    所有转发线程共享同一个速率预算：桶按 rate 匀速补充令牌，
+    acquire() 在没有令牌时阻塞等待。相比每条消息固定睡1-2秒，
+    多个群可以并发发送，总速率仍然被压在安全值以内。
+    """
+
+    def __init__(self, rate: float = 1.0, capacity: int = 3):
+        self.rate = rate          # 每秒补充的令牌数
+        self.capacity = capacity  # 桶容量（允许的突发量）
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+        self._cond = threading.Condition()
+
+    def acquire(self) -> None:
+        """取走一个令牌，不够则等到补满为止"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                # 等到下一个令牌大致补上来再重试
+                self._cond.wait(timeout=(1 - self._tokens) / self.rate)
+
+
+class ForwardState(IntEnum):
+    # IntEnum：状态比较走C层整数比较，每条消息都要比一次
+    IDLE = 0
+    WAITING_CHOICE_MODE = 1
+    WAITING_MESSAGE = 2
+    WAITING_CHOICE = 3
+    WELCOME_MANAGE = 4  # 迎新消息管理状态
+    WELCOME_GROUP_CHOICE = 5  # 选择要管理迎新消息的群
+    WELCOME_COLLECTING = 6  # 收集新的迎新消息
+
+@dataclass(slots=True)
 class OperatorState:
     """每个操作者的状态"""
     state: ForwardState = ForwardState.IDLE
     list_id: Optional[int] = None
     messages: List[WxMsg] = None
     current_group: Optional[str] = None  # 当前正在管理迎新消息的群ID
+    touched: float = field(default_factory=time.monotonic)  # 最近一次活动时间
 
     def __post_init__(self):
         if self.messages is None:
@@ -46,42 +132,138 @@ class NCCManager:
         self.welcome_service = WelcomeService(wcf)  # 初始化迎新服务
         self.db = DatabaseManager()  # 初始化数据库管理器
         self.images_dir = os.path.join(os.path.dirname(__file__), "ncc_images")
-        if not os.path.exists(self.images_dir):
-            os.makedirs(self.images_dir)
-            
-        self.image_lock = Lock()
+        os.makedirs(self.images_dir, exist_ok=True)
+
+
         self.operator_states: Dict[str, OperatorState] = {}  # 每个操作者的状态
+
+        # 转发列表的内存缓存，避免每次进入选择菜单都查库
+        self._lists_cache: Optional[List] = None
+        self._lists_ts = 0.0
+        self._LISTS_TTL = 300  # 秒
+
+        # 管理员称呼缓存，查看团队成员时不用每次查库
+        self._admin_names_cache: Optional[List[str]] = None
+        self._admin_names_ts = 0.0
+
+        # 管理员wxid集合缓存：frozenset 的成员判断是O(1)，短TTL兜底变更
+        self._admin_wxids_cache = (0.0, frozenset())
         
+        # 状态 -> 处理方法 的分发表，代替一长串 if/elif
+        self._state_handlers = {
+            ForwardState.WAITING_CHOICE_MODE: self._state_waiting_choice_mode,
+            ForwardState.WAITING_MESSAGE: self._state_waiting_message,
+            ForwardState.WAITING_CHOICE: self._state_waiting_choice,
+            ForwardState.WELCOME_GROUP_CHOICE: self._state_welcome_group_choice,
+            ForwardState.WELCOME_MANAGE: self._state_welcome_manage,
+            ForwardState.WELCOME_COLLECTING: self._state_welcome_collecting,
+        }
+        # 主菜单选项 -> 命令方法 的分发表
+        self._choice_handlers = {
+            "1": self._cmd_forward,
+            "2": self._cmd_sync,
+            "3": self._cmd_link,
+            "4": self._cmd_team,
+            "5": self._cmd_welcome,
+        }
+
+        # 图片下载放到后台线程池，收集阶段不再阻塞在 download_image 上
+        self._image_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ImgDL")
+        self._image_futures: Dict[int, object] = {}  # msg.id -> 下载任务的 Future
+        self._image_paths: Dict[int, str] = {}  # msg.id -> 已下载的图片路径
+        # 限制同时进行的图片发送数量：不像全局锁那样完全串行，又不至于打满wcferry
+        self._image_sem = threading.BoundedSemaphore(4)
+
+        # 所有转发线程共享的令牌桶：总发送速率约1条/秒，允许3条突发
+        self._limiter = TokenBucket(rate=1.0, capacity=3)
+
+        # 常驻的转发线程池：各任务复用同一批线程，不用每个任务建销一次池子
+        self._forward_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="Forward")
+
         # 添加消息队列和处理线程
         self.forward_queue = Queue()
         self.forward_thread = threading.Thread(target=self._process_forward_queue, daemon=True)
         self.forward_thread.start()
 
+    def _get_forward_lists(self) -> List:
+        """获取转发列表，带TTL缓存
+
+        列表数据只在 Notion 同步后才会变化，加个5分钟缓存，
+        菜单交互就不用每次都开数据库查询。
+        """
+        now = time.monotonic()
+        if self._lists_cache is None or now - self._lists_ts > self._LISTS_TTL:
+            with self.db.get_reader() as conn:
+                cur = conn.cursor()
+                cur.execute(_SQL_FORWARD_LISTS)
+                self._lists_cache = cur.fetchall()
+            self._lists_ts = now
+        return self._lists_cache
+
+    def _invalidate_lists_cache(self) -> None:
+        """清除转发列表缓存（Notion 同步后调用）"""
+        self._lists_cache = None
+        self._admin_names_cache = None
+        self._admin_wxids_cache = (0.0, frozenset())
+        self._groups_for_lists.cache_clear()
+        self.db.invalidate_cache()
+
+    @lru_cache(maxsize=32)
+    def _groups_for_lists(self, list_ids: tuple) -> tuple:
+        """解析所选列表对应的可转发群，返回 (wxid, 群名) 元组，按选择组合缓存
+
+        去重在SQL里做，ORDER BY 保证同一选择每次得到相同顺序，
+        转发日志和限流诊断才好对得上。
+        """
+        with self.db.get_reader() as conn:
+            cur = conn.cursor()
+            if 1 in list_ids:  # 如果选择了"所有群聊"
+                cur.execute(_SQL_GROUPS_ALL)
+            else:
+                cur.execute(_groups_sql(len(list_ids)), list_ids)
+            # 连群名一起取回来，失败报告就不用再挨个问wcferry要群名
+            return tuple((row[0], row[1]) for row in cur)
+
+    def _get_admin_wxids(self) -> frozenset:
+        """获取管理员wxid集合，带TTL缓存
+
+        每条以"ncc"开头的消息都要做一次权限判断，
+        用 frozenset 做成员判断并缓存，省掉每条消息一次数据库查询。
+        """
+        now = time.monotonic()
+        ts, admins = self._admin_wxids_cache
+        if not admins or now - ts > self._LISTS_TTL:
+            admins = frozenset(self.db.get_admin_wxids())
+            self._admin_wxids_cache = (now, admins)
+        return admins
+
+    def _get_admin_names(self) -> List[str]:
+        """获取管理员称呼列表，带TTL缓存"""
+        now = time.monotonic()
+        if self._admin_names_cache is None or now - self._admin_names_ts > self._LISTS_TTL:
+            self._admin_names_cache = self.db.get_admin_names()
+            self._admin_names_ts = now
+        return self._admin_names_cache
+
     def _get_operator_state(self, operator_id: str) -> OperatorState:
-        """获取操作者的状态，如果不存在则创建"""
-        if operator_id not in self.operator_states:
-            self.operator_states[operator_id] = OperatorState()
-        return self.operator_states[operator_id]
+        """获取操作者的状态，如果不存在则创建
+
+        setdefault 是单次原子字典操作，消息线程和转发线程
+        并发读写时没有先查后插的竞态窗口。
+        """
+        return self.operator_states.setdefault(operator_id, OperatorState())
 
     def _send_menu(self, receiver):
         """发送NCC管理菜单"""
-        menu = (
-            "NCC社群管理：\n"
-            "请回复指定数字\n"
-            "1 👈 转发消息\n"
-            "2 👈 同步 Notion 更改\n"
-            "3 👈 查看 Notion 后台\n"
-            "4 👈 查看团队成员\n"
-            "5 👈 迎新消息管理\n"
-            "0 👈 退出管理模式"
-        )
-        self.sendTextMsg(menu, receiver)
+        self.sendTextMsg(_MENU_TEXT, receiver)
         
     def handle_message(self, msg) -> bool:
         """统一处理所有NCC相关消息"""
-        if msg.content.lower().strip() == "ncc":
-            admin_wxids = self.db.get_admin_wxids()
-            if msg.sender in admin_wxids:
+        content = msg.content
+        # 绝大多数消息和"ncc"无关，先用长度挡掉，再做strip/lower的字符串分配
+        if len(content) <= 8 and content.strip().lower() == "ncc":
+            if msg.sender in self._get_admin_wxids():
+                self._purge_stale_states()
                 operator_state = self._get_operator_state(msg.sender)
                 operator_state.state = ForwardState.WAITING_CHOICE_MODE
                 self._send_menu(msg.sender)
@@ -97,238 +279,286 @@ class NCCManager:
         
         return False
 
+    def _purge_stale_states(self) -> None:
+        """清理长时间没有动静的操作会话
+
+        管理员中途弃操作时状态会一直留在字典里，顺手在有人进入
+        管理模式时清一遍，不用再开一个定时线程。
+        """
+        deadline = time.monotonic() - 1800  # 半小时没动静就算弃了
+        for operator_id, state in list(self.operator_states.items()):
+            if state.touched < deadline:
+                # 走统一的重置入口，把挂着的图片下载也清掉
+                self._reset_operator_state(operator_id)
+
     def _handle_forward_state(self, msg: WxMsg, operator_state: OperatorState) -> bool:
-        """处理不同状态下的消息"""
+        """处理不同状态下的消息，按状态分发到对应的处理方法"""
+        operator_state.touched = time.monotonic()
         # 在任何状态下都可以退出
         if msg.content == "0":
             self._reset_operator_state(msg.sender)
             self.sendTextMsg("已退出管理模式", msg.sender)
             return True
 
-        if operator_state.state == ForwardState.WAITING_CHOICE_MODE:
-            if msg.content == "5":  # 进入迎新消息管理模式
-                operator_state.state = ForwardState.WELCOME_GROUP_CHOICE
-                # 获取所有启用了迎新推送的群组
-                groups = self.db.get_welcome_enabled_groups()
-                if not groups:
-                    self.sendTextMsg("未找到启用迎新推送的群组，请先在Notion的群管理页面开启迎新推送开关", msg.sender)
-                    self._reset_operator_state(msg.sender)
-                    return True
-                
-                response = "所有开启迎新推送的群聊列表：\n（迎新消息开关请在Notion的群管理页面操作）\n\n"
-                for i, group in enumerate(groups, 1):
-                    response += f"{i} 👈 {group['name']}\n"
-                response += "\n请回复数字选择要管理的群聊，回复0退出"
-                self.sendTextMsg(response, msg.sender)
-                return True
+        handler = self._state_handlers.get(operator_state.state)
+        if handler:
+            return handler(msg, operator_state)
+        return False
 
-            elif msg.content == "2":  # 同步 Notion 数据到本地缓存
-                self.robot.sync_data_from_notion()  # 使用 robot 的同步方法
-                self.sendTextMsg("同步成功，请选择操作", msg.sender)
-                self._send_menu(msg.sender)
-                return True
-            elif msg.content == "1":  # 进入消息转发模式
-                operator_state.state = ForwardState.WAITING_MESSAGE
-                operator_state.messages = []
-                self.sendTextMsg("请发送需要转发的内容，支持公众号、推文、视频号、文字、图片、合并消息，一个一个来\n发送【1】进入下一步\n随时发送【0】退出转发模式", msg.sender)
+    def _state_waiting_choice_mode(self, msg: WxMsg, operator_state: OperatorState) -> bool:
+        """主菜单：按输入内容分发到对应命令"""
+        handler = self._choice_handlers.get(msg.content)
+        if handler:
+            return handler(msg, operator_state)
+        self.sendTextMsg("请输入有效的选项，或发送【0】退出转发模式", msg.sender)
+        return True
+
+    def _cmd_forward(self, msg: WxMsg, operator_state: OperatorState) -> bool:
+        """菜单1：进入消息转发模式"""
+        operator_state.state = ForwardState.WAITING_MESSAGE
+        operator_state.messages = []
+        self.sendTextMsg(_FORWARD_PROMPT, msg.sender)
+        return True
+
+    def _cmd_sync(self, msg: WxMsg, operator_state: OperatorState) -> bool:
+        """菜单2：同步 Notion 数据到本地缓存"""
+        self.robot.sync_data_from_notion()  # 使用 robot 的同步方法
+        self._invalidate_lists_cache()
+        # 提示和菜单合并成一条消息发出
+        self.sendTextMsgs(["同步成功，请选择操作", _MENU_TEXT], msg.sender)
+        return True
+
+    def _cmd_link(self, msg: WxMsg, operator_state: OperatorState) -> bool:
+        """菜单3：查看 Notion 后台链接"""
+        self.sendTextMsg(_NOTION_LINK_TEXT, msg.sender)
+        return True
+
+    def _cmd_team(self, msg: WxMsg, operator_state: OperatorState) -> bool:
+        """菜单4：查看团队成员列表"""
+        # 获取管理员称呼列表（走缓存）
+        admin_names = self._get_admin_names()
+        admin_list = "成员：\n" + "\n".join(f"👤 {name}" for name in admin_names)
+        self.sendTextMsg(admin_list, msg.sender)
+        return True
+
+    def _cmd_welcome(self, msg: WxMsg, operator_state: OperatorState) -> bool:
+        """菜单5：进入迎新消息管理模式"""
+        operator_state.state = ForwardState.WELCOME_GROUP_CHOICE
+        # 获取所有启用了迎新推送的群组
+        groups = self.db.get_welcome_enabled_groups()
+        if not groups:
+            self.sendTextMsg("未找到启用迎新推送的群组，请先在Notion的群管理页面开启迎新推送开关", msg.sender)
+            self._reset_operator_state(msg.sender)
+            return True
+
+        parts = ["所有开启迎新推送的群聊列表：", "（迎新消息开关请在Notion的群管理页面操作）", ""]
+        parts.extend(f"{i} 👈 {group['name']}" for i, group in enumerate(groups, 1))
+        parts.append("")
+        parts.append("请回复数字选择要管理的群聊，回复0退出")
+        self.sendTextMsg("\n".join(parts), msg.sender)
+        return True
+
+    def _state_waiting_message(self, msg: WxMsg, operator_state: OperatorState) -> bool:
+        """信息收集阶段"""
+        if msg.content == "1":
+            if not operator_state.messages:
+                self.sendTextMsg("还未收集到任何消息，请先发送需要转发的内容", msg.sender)
                 return True
-            elif msg.content == "3":  # 查看 Notion 后台链接
-                self.sendTextMsg("列表信息，请登陆查看：https://www.notion.so/bigsong/NCC-1564e93f5682805d9a2ff0519c24738b?pvs=4", msg.sender)
+
+            # 等待后台图片下载全部完成，失败的从待转发列表移除
+            failed = self._resolve_pending_images(operator_state)
+            if failed:
+                self.sendTextMsg(f"{failed} 张图片下载失败，已从待转发列表移除", msg.sender)
+            if not operator_state.messages:
+                self.sendTextMsg("图片均下载失败，请重新发送需要转发的内容", msg.sender)
                 return True
-            elif msg.content == "4":  # 查看团队成员列表
-                # 获取管理员称呼列表
-                admin_names = self.db.get_admin_names()
-                admin_list = "成员：\n" + "\n".join(f"👤 {name}" for name in admin_names)
-                self.sendTextMsg(admin_list, msg.sender)
+
+            operator_state.state = ForwardState.WAITING_CHOICE
+            # 从缓存获取转发列表
+            lists = self._get_forward_lists()
+
+            if not lists:
+                self.sendTextMsg("未找到可用的转发列表，请先使用【刷新列表】更新数据", msg.sender)
+                self._reset_operator_state(msg.sender)
                 return True
-            else:
-                self.sendTextMsg("请输入有效的选项，或发送【0】退出转发模式", msg.sender)
+
+            parts = [
+                f"已收集 {len(operator_state.messages)} 条消息",
+                "请选择想要转发的分组编号项（支持多选，如：1+2+3），按0退出：",
+                "",
+                "1 👈 所有群聊",  # "所有群聊"选项
+            ]
+            # 遍历列表
+            parts.extend(
+                f"{list_id} 👈 {list_name}" + (f" （{description}）" if description else "")
+                for list_id, list_name, description in lists
+            )
+            # 发送群聊列表给发送者，以供选择
+            self.sendTextMsg("\n".join(parts), msg.sender)
             return True
-        
-        #信息收集阶段
-        elif operator_state.state == ForwardState.WAITING_MESSAGE:
-            if msg.content == "1":
-                if not operator_state.messages:
-                    self.sendTextMsg("还未收集到任何消息，请先发送需要转发的内容", msg.sender)
-                    return True
-                
-                operator_state.state = ForwardState.WAITING_CHOICE
-                # 从数据库获取转发列表
-                with self.db.get_db() as conn:
-                    cur = conn.cursor()
-                    cur.execute('''
-                        SELECT list_id, list_name, description
-                        FROM forward_lists
-                        ORDER BY list_id
-                    ''')
-                    lists = cur.fetchall()
-                
-                if not lists:
-                    self.sendTextMsg("未找到可用的转发列表，请先使用【刷新列表】更新数据", msg.sender)
-                    self._reset_operator_state(msg.sender)
-                    return True
-                    
-                response = f"已收集 {len(operator_state.messages)} 条消息\n请选择想要转发的分组编号项（支持多选，如：1+2+3），按0退出：\n\n"
-                # 添加"所有群聊"选项
-                response += f"1 👈 所有群聊\n"
-                # 遍历列表
-                for list_id, list_name, description in lists:
-                    response += f"{list_id} 👈 {list_name}"
-                    if description:
-                        response += f" （{description}）"
-                    response += "\n"
-                # 发送群聊列表给发送者，以供选择
-                self.sendTextMsg(response, msg.sender)
-                return True
-            
+
+        try:
+            # 只有图片消息需要特殊处理（后台提前下载原图）
+            if msg.type == 3:
+                self.sendTextMsg("检测到图片消息，原图在后台下载中，可以继续发送其他内容", msg.sender)
+                self._image_futures[msg.id] = self._image_pool.submit(
+                    self.wcf.download_image, msg.id, msg.extra, self.images_dir, 120)
+
+            # 所有消息都直接添加到收集器
+            operator_state.messages.append(msg)
+            logger.info("消息已添加到收集器，当前数量: %s", len(operator_state.messages))
+            self.sendTextMsg(f"已收集 {len(operator_state.messages)} 条消息，继续发送或者回复【1】选择群聊", msg.sender)
+
+        except Exception as e:
+            logger.error("消息收集失败: %s", e, exc_info=True)
+            self.sendTextMsg("消息收集异常，请联系管理员", msg.sender)
+        return True
+
+    def _resolve_pending_images(self, operator_state: OperatorState) -> int:
+        """等待后台图片下载完成，返回下载失败而被移除的消息数
+
+        下载成功的图片路径记入 self._image_paths，供转发阶段直接使用。
+        """
+        failed = 0
+        kept = []
+        for m in operator_state.messages:
+            fut = self._image_futures.pop(m.id, None)
+            if fut is None:
+                kept.append(m)
+                continue
+            img_path = None
             try:
-                # 只有图片消息需要特殊处理（提前下载）
-                if msg.type == 3:
-                    self.sendTextMsg("检测到图片消息，原图上传有点慢，等会儿，好了叫你", msg.sender)
-                    img_path = self.wcf.download_image(msg.id, msg.extra, self.images_dir, timeout=120)
-                    if not img_path or not os.path.exists(img_path):
-                        self.sendTextMsg("图片下载失败，请检查图片是否正常", msg.sender)
-                        return True
-                    logger.info(f"图片下载成功: {img_path}")
-                
-                # 所有消息都直接添加到收集器
-                operator_state.messages.append(msg)
-                logger.info(f"消息已添加到收集器，当前数量: {len(operator_state.messages)}")
-                self.sendTextMsg(f"已收集 {len(operator_state.messages)} 条消息，继续发送或者回复【1】选择群聊", msg.sender)
-                
-            except TimeoutError:
-                logger.error("图片下载超时")
-                self.sendTextMsg("图片下载超时，请稍后重试", msg.sender)
+                img_path = fut.result(timeout=130)
             except Exception as e:
-                logger.error(f"消息收集失败: {e}", exc_info=True)
-                self.sendTextMsg("消息收集异常，请联系管理员", msg.sender)
-            return True
+                logger.error("图片下载失败: %s", e)
+            if img_path and os.path.exists(img_path):
+                self._image_paths[m.id] = img_path
+                logger.info("图片下载成功: %s", img_path)
+                kept.append(m)
+            else:
+                failed += 1
+        operator_state.messages = kept
+        return failed
 
-        #转发阶段    
-        elif operator_state.state == ForwardState.WAITING_CHOICE:
-            try:
-                # 处理多选列表
-                list_ids = [int(list_id.strip()) for list_id in msg.content.split("+")]
-                
-                if operator_state.messages:
-                    groups = set()  # 使用集合来自动去重
-                    
-                    # 获取所有群组
-                    with self.db.get_db() as conn:
-                        cur = conn.cursor()
-                        if 1 in list_ids:  # 如果选择了"所有群聊"
-                            cur.execute('''
-                                SELECT DISTINCT g.wxid 
-                                FROM groups g
-                                JOIN group_lists gl ON g.wxid = gl.group_wxid
-                                WHERE g.allow_forward = 1
-                            ''')
-                        else:
-                            placeholders = ','.join('?' * len(list_ids))
-                            cur.execute(f'''
-                                SELECT DISTINCT g.wxid 
-                                FROM groups g
-                                JOIN group_lists gl ON g.wxid = gl.group_wxid
-                                WHERE gl.list_id IN ({placeholders}) 
-                                AND g.allow_forward = 1
-                            ''', list_ids)
-                        groups = {row[0] for row in cur.fetchall()}
-                    
-                    if not groups:
-                        self.sendTextMsg("未找到任何可转发的群组，请重新选择，或发送【0】退出转发模式", msg.sender)
-                        return True
-                        
-                    total_groups = len(groups)
-                    total_messages = len(operator_state.messages)
-                    
-                    self.sendTextMsg(f"开始转发 {total_messages} 条消息到 {total_groups} 个群...\n为避免风控，将会添加随机延迟，请耐心等待...", msg.sender)
-                    
-                    # 将转发任务添加到队列
-                    self.forward_queue.put((operator_state.messages, list(groups), msg.sender))
-                    self._reset_operator_state(msg.sender)
-                
-                return True
-                
-            except ValueError:
-                self.sendTextMsg("请输入有效的选项（支持多选，如：1+2+3），或发送【0】退出转发模式", msg.sender)
+    def _state_waiting_choice(self, msg: WxMsg, operator_state: OperatorState) -> bool:
+        """转发阶段"""
+        try:
+            # 处理多选列表
+            list_ids = [int(list_id.strip()) for list_id in msg.content.split("+")]
+
+            # 先对着缓存的列表编号做O(1)校验，乱输的编号不用跑SQL
+            valid_ids = {1} | {row[0] for row in self._get_forward_lists()}
+            invalid = [i for i in list_ids if i not in valid_ids]
+            if invalid:
+                self.sendTextMsg(f"编号 {'、'.join(map(str, invalid))} 不存在，请重新选择，或发送【0】退出转发模式", msg.sender)
                 return True
-                
-        elif operator_state.state == ForwardState.WELCOME_GROUP_CHOICE:
-            try:
-                choice = int(msg.content)
-                if choice == 0:  # 退出迎新消息管理
-                    self._reset_operator_state(msg.sender)
-                    self.sendTextMsg("已退出迎新消息管理", msg.sender)
-                    return True
 
-                groups = self.db.get_welcome_enabled_groups()
-                if 1 <= choice <= len(groups):  # 选择要管理的群，进入迎新消息管理菜单
-                    group = groups[choice - 1]
-                    operator_state.current_group = group['wxid']
-                    operator_state.state = ForwardState.WELCOME_MANAGE
-                    self.welcome_service.show_menu(msg.sender)  # 显示迎新消息管理菜单（查看/设置）
+            if operator_state.messages:
+                # 获取所有群组（去重排序后作为缓存键，重试同一选择不再查库）
+                groups = self._groups_for_lists(tuple(sorted(set(list_ids))))
+
+                if not groups:
+                    self.sendTextMsg("未找到任何可转发的群组，请重新选择，或发送【0】退出转发模式", msg.sender)
                     return True
-                else:
-                    self.sendTextMsg("无效的选择，请重新输入", msg.sender)
+
+                total_groups = len(groups)
+                total_messages = len(operator_state.messages)
+
+                # 小任务很快就能发完，省掉"开始转发"预告，只保留最终结果
+                if total_messages * total_groups > 3:
+                    self.sendTextMsg(f"开始转发 {total_messages} 条消息到 {total_groups} 个群...\n为避免风控，将会添加随机延迟，请耐心等待...", msg.sender)
+
+                # 将转发任务添加到队列；消息所有权交给队列任务，
+                # 清空引用后重置状态才不会把任务要用的图片路径清掉
+                self.forward_queue.put((operator_state.messages, list(groups), msg.sender))
+                operator_state.messages = []
+                self._reset_operator_state(msg.sender)
+
+            return True
+
+        except ValueError:
+            self.sendTextMsg("请输入有效的选项（支持多选，如：1+2+3），或发送【0】退出转发模式", msg.sender)
+            return True
+
+    def _state_welcome_group_choice(self, msg: WxMsg, operator_state: OperatorState) -> bool:
+        """选择要管理迎新消息的群"""
+        try:
+            choice = int(msg.content)
+            if choice == 0:  # 退出迎新消息管理
+                self._reset_operator_state(msg.sender)
+                self.sendTextMsg("已退出迎新消息管理", msg.sender)
                 return True
-            except ValueError:
-                self.sendTextMsg("请输入有效的数字", msg.sender)
+
+            groups = self.db.get_welcome_enabled_groups()
+            if 1 <= choice <= len(groups):  # 选择要管理的群，进入迎新消息管理菜单
+                group = groups[choice - 1]
+                operator_state.current_group = group['wxid']
+                operator_state.state = ForwardState.WELCOME_MANAGE
+                self.welcome_service.show_menu(msg.sender)  # 显示迎新消息管理菜单（查看/设置）
                 return True
+            else:
+                self.sendTextMsg("无效的选择，请重新输入", msg.sender)
+            return True
+        except ValueError:
+            self.sendTextMsg("请输入有效的数字", msg.sender)
+            return True
 
-        elif operator_state.state == ForwardState.WELCOME_MANAGE: #上一步选择群后，进入迎新消息管理菜单
-            try:
-                choice = int(msg.content)
-                if choice == 0:  # 退出迎新消息管理
-                    self._reset_operator_state(msg.sender)
-                    self.sendTextMsg("已退出迎新消息管理", msg.sender)
-                    return True
-                elif choice == 1:  # 查看当前群的迎新消息（在welcome_service.py中实现）
-                    self.welcome_service.show_current_messages(operator_state.current_group, msg.sender)
-                    return True
-                elif choice == 2:  # 设置新的迎新消息，进入消息收集状态
-                    operator_state.state = ForwardState.WELCOME_COLLECTING
-                    operator_state.messages = []
-                    self.sendTextMsg("请发送新的迎新消息，发送完成后回复数字1", msg.sender)
-                    return True
-                else:
-                    self.sendTextMsg("无效的选择，请重新输入。退出请回复0", msg.sender)
+    def _state_welcome_manage(self, msg: WxMsg, operator_state: OperatorState) -> bool:
+        """上一步选择群后，进入迎新消息管理菜单"""
+        try:
+            choice = int(msg.content)
+            if choice == 0:  # 退出迎新消息管理
+                self._reset_operator_state(msg.sender)
+                self.sendTextMsg("已退出迎新消息管理", msg.sender)
                 return True
-            except ValueError:
-                self.sendTextMsg("请输入有效的数字。退出请回复0", msg.sender)
+            elif choice == 1:  # 查看当前群的迎新消息（在welcome_service.py中实现）
+                self.welcome_service.show_current_messages(operator_state.current_group, msg.sender)
                 return True
+            elif choice == 2:  # 设置新的迎新消息，进入消息收集状态
+                operator_state.state = ForwardState.WELCOME_COLLECTING
+                operator_state.messages = []
+                self.sendTextMsg("请发送新的迎新消息，发送完成后回复数字1", msg.sender)
+                return True
+            else:
+                self.sendTextMsg("无效的选择，请重新输入。退出请回复0", msg.sender)
+            return True
+        except ValueError:
+            self.sendTextMsg("请输入有效的数字。退出请回复0", msg.sender)
+            return True
 
-        elif operator_state.state == ForwardState.WELCOME_COLLECTING:
-            if msg.content == "1":  # 完成消息收集，保存并返回管理菜单
-                if not operator_state.messages:
-                    self.sendTextMsg("未收到任何消息，请重新发送，退出请回复0", msg.sender)
-                    return True
-                
-                # 保存消息（在welcome_service.py中实现）
-                self.welcome_service.save_messages(operator_state.current_group, operator_state.messages, msg.sender)
-                
-                # 重置状态
-                self._reset_operator_state(msg.sender)
+    def _state_welcome_collecting(self, msg: WxMsg, operator_state: OperatorState) -> bool:
+        """收集新的迎新消息"""
+        if msg.content == "1":  # 完成消息收集，保存并返回管理菜单
+            if not operator_state.messages:
+                self.sendTextMsg("未收到任何消息，请重新发送，退出请回复0", msg.sender)
                 return True
-                
-            # 收集消息（支持文本、图片、合并转发消息，具体处理在welcome_service.py中）
-            operator_state.messages.append(msg)
-            self.sendTextMsg(f"✅ 已收集 {len(operator_state.messages)} 条消息，继续发送或回复数字1完成设置", msg.sender)
+
+            # 保存消息（在welcome_service.py中实现）
+            self.welcome_service.save_messages(operator_state.current_group, operator_state.messages, msg.sender)
+
+            # 重置状态
+            self._reset_operator_state(msg.sender)
             return True
 
-        return False
-    
+        # 收集消息（支持文本、图片、合并转发消息，具体处理在welcome_service.py中）
+        operator_state.messages.append(msg)
+        self.sendTextMsg(f"✅ 已收集 {len(operator_state.messages)} 条消息，继续发送或回复数字1完成设置", msg.sender)
+        return True
+
     def _forward_message(self, msg: WxMsg, receiver: str) -> bool:
         """根据消息类型选择合适的转发方式"""
         if msg.type == 3:  # 图片消息
             try:
-                with self.image_lock:  # 只锁定发送过程
-                    img_path = os.path.join(self.images_dir, f"{msg.id}_{msg.extra}")
-                    if os.path.exists(img_path):
-                        if self.wcf.send_image(img_path, receiver) == 0:
-                            time.sleep(0.5)  # 等待发送完成
-                            return True
+                # 收集阶段已验证并记录下载路径，这里不再重复拼路径和stat
+                img_path = self._image_paths.get(msg.id)
+                if img_path:
+                    # send_image 返回即发送完成，发送间隔交给令牌桶控制
+                    with self._image_sem:
+                        rc = self.wcf.send_image(img_path, receiver)
+                    if rc == 0:
+                        return True
             except Exception as e:
-                logger.error(f"图片发送失败: {e}")
+                logger.error("图片发送失败: %s", e)
                 return False
             
             # 如果发送失败，尝试直接转发
@@ -338,100 +568,157 @@ class NCCManager:
         return self.wcf.forward_msg(msg.id, receiver) == 1
     
     def _reset_operator_state(self, operator_id: str) -> None:
-        """重置特定操作者的状态"""
-        if operator_id in self.operator_states:
-            del self.operator_states[operator_id]
+        """重置特定操作者的状态
+
+        中途退出时收集到的消息随状态一起丢弃，挂在上面的图片
+        下载任务和已落盘的路径也一并清理，长期运行不会越积越多。
+        已交给转发队列的任务会先清空 messages，不受影响。
+        """
+        state = self.operator_states.pop(operator_id, None)
+        if state is None:
+            return
+        for m in state.messages:
+            fut = self._image_futures.pop(m.id, None)
+            if fut is not None:
+                fut.cancel()
+            self._image_paths.pop(m.id, None)
 
     def sendTextMsg(self, msg: str, receiver: str) -> None:
         """发送文本消息"""
         self.wcf.send_text(msg, receiver)
 
+    def sendTextMsgs(self, msgs: List[str], receiver: str) -> None:
+        """把连续的几段文案合并成一条消息，省掉多余的RPC往返"""
+        self.wcf.send_text("\n\n".join(msgs), receiver)
+
+    def _forward_to_group(self, group: str, messages: List[WxMsg]) -> tuple:
+        """向单个群顺序转发所有消息，返回 (成功数, 失败数, 失败消息列表)
+
+        群内消息保持顺序发送，不同群之间由线程池并发。
+        """
+        MAX_RETRIES = 3  # 最大重试次数
+        MAX_CONSEC_FAILS = 3  # 连续失败这么多条就断路，不再硬怼这个群
+        success_count = 0
+        failed_count = 0
+        group_failed_messages = []  # 记录当前群发送失败的消息
+        log_rows = []  # 每条消息的投递结果，任务结束后整批落库
+        consec_fails = 0
+
+        for i, msg in enumerate(messages):
+            retries = 0
+            success = False
+
+            # 添加重试机制
+            while retries < MAX_RETRIES and not success:
+                try:
+                    # 发送速率由共享令牌桶统一控制，外加一点抖动避免步调一致
+                    self._limiter.acquire()
+                    time.sleep(random.uniform(0, 0.2))
+                    if self._forward_message(msg, group):
+                        success = True
+                        success_count += 1
+                    else:
+                        retries += 1
+                        if retries < MAX_RETRIES:
+                            # 指数退避加抖动：瞬时故障多半很快恢复，反复失败则拉开间隔
+                            time.sleep(min(2 ** retries, 4) + random.uniform(0, 0.5))
+                except Exception as e:
+                    logger.error("发送消息失败 (重试 %s/%s): %s", retries + 1, MAX_RETRIES, e)
+                    retries += 1
+                    if retries < MAX_RETRIES:
+                        time.sleep(min(2 ** retries, 4) + random.uniform(0, 0.5))
+
+            if not success:
+                failed_count += 1
+                consec_fails += 1
+                group_failed_messages.append({
+                    'msg_id': msg.id,
+                    'type': msg.type,
+                    'error': f"发送失败，已重试 {MAX_RETRIES} 次"
+                })
+            else:
+                consec_fails = 0
+
+            log_rows.append((msg.id, group, 1 if success else 0, retries))
+
+            # 连续失败多半是群已解散或被踢，剩下的消息不再浪费发送配额
+            if consec_fails >= MAX_CONSEC_FAILS:
+                for rest in messages[i + 1:]:
+                    failed_count += 1
+                    group_failed_messages.append({
+                        'msg_id': rest.id,
+                        'type': rest.type,
+                        'error': "该群连续发送失败，剩余消息已跳过"
+                    })
+                    log_rows.append((rest.id, group, 0, 0))
+                logger.warning("群 %s 连续失败 %s 条，跳过剩余消息", group, consec_fails)
+                break
+
+        return success_count, failed_count, group_failed_messages, log_rows
+
     def _process_forward_queue(self):
         """处理转发队列的后台线程"""
-        MAX_RETRIES = 3  # 最大重试次数
-        
         while True:
             try:
                 # 从队列获取转发任务
                 task = self.forward_queue.get()
                 if task is None:
                     continue
-                    
+
                 messages, groups, operator_id = task
                 total_groups = len(groups)
                 total_messages = len(messages)
-                
+                started = time.monotonic()
+
                 success_count = 0
                 failed_count = 0
                 failed_messages = []  # 记录失败的消息
-                
-                # 为每个群添加随机延迟
-                for i, group in enumerate(groups):
-                    # 每个群之间的基础延迟3-5秒
-                    group_delay = random.uniform(3, 5)
-                    
-                    # 每10个群增加额外延迟5-10秒，避免频繁发送
-                    if i > 0 and i % 10 == 0:
-                        extra_delay = random.uniform(5, 10)
-                        time.sleep(extra_delay)
-                    
-                    group_failed_messages = []  # 记录当前群发送失败的消息
-                    
-                    for msg in messages:
-                        retries = 0
-                        success = False
-                        
-                        # 添加重试机制
-                        while retries < MAX_RETRIES and not success:
-                            try:
-                                if self._forward_message(msg, group):
-                                    success = True
-                                    success_count += 1
-                                else:
-                                    retries += 1
-                                    if retries < MAX_RETRIES:
-                                        time.sleep(2)  # 重试前等待
-                            except Exception as e:
-                                logger.error(f"发送消息失败 (重试 {retries + 1}/{MAX_RETRIES}): {e}")
-                                retries += 1
-                                if retries < MAX_RETRIES:
-                                    time.sleep(2)
-                        
-                        if not success:
-                            failed_count += 1
-                            group_failed_messages.append({
-                                'msg_id': msg.id,
-                                'type': msg.type,
-                                'error': f"发送失败，已重试 {MAX_RETRIES} 次"
-                            })
-                        
-                        # 每条消息间隔1-2秒
-                        time.sleep(random.uniform(1, 2))
-                    
+                log_rows = []  # 全任务的投递日志，最后一个事务写入
+
+                # 各个群之间并发转发，单个群内保持消息顺序（总速率由令牌桶控制）
+                # 任务里的群带着 (wxid, 群名)，失败报告直接用名字，不再找wcferry反查
+                future_to_group = {
+                    self._forward_pool.submit(self._forward_to_group, wxid, messages): (wxid, name)
+                    for wxid, name in groups
+                }
+                for future in as_completed(future_to_group):
+                    wxid, name = future_to_group[future]
+                    ok, fail, group_failed_messages, group_log_rows = future.result()
+                    success_count += ok
+                    failed_count += fail
+                    log_rows.extend(group_log_rows)
                     if group_failed_messages:
                         failed_messages.append({
-                            'group': group,
+                            'group': name or wxid,
                             'messages': group_failed_messages
                         })
-                    
-                    time.sleep(group_delay)
-                
-                # 发送最终结果
-                status = f"转发完成！\n成功：{success_count} 条\n失败：{failed_count} 条\n总计：{total_messages} 条消息到 {total_groups} 个群"
-                
+
+                # 整个任务的投递结果一个事务批量落库
+                self.db.log_forward_results(log_rows)
+
+                # 发送最终结果：全部成功时只发一行，失败时才展开明细
+                elapsed = time.monotonic() - started
+                if not failed_count:
+                    status = _STATUS_OK_TMPL % (total_messages, total_groups, elapsed)
+                else:
+                    status = _STATUS_TMPL % (success_count, failed_count, total_messages, total_groups)
+
                 # 如果有失败的消息，添加详细信息
                 if failed_messages:
                     status += "\n\n失败详情："
                     for group_fail in failed_messages:
-                        group_name = self.wcf.get_room_name(group_fail['group']) or group_fail['group']
-                        status += f"\n群「{group_name}」:"
+                        status += f"\n群「{group_fail['group']}」:"
                         for msg in group_fail['messages']:
                             status += f"\n- 消息ID {msg['msg_id']} (类型 {msg['type']}): {msg['error']}"
                 
                 self.sendTextMsg(status, operator_id)
-                
+
+                # 任务结束后清掉本批消息的图片路径缓存，字典不随任务数膨胀
+                for msg in messages:
+                    self._image_paths.pop(msg.id, None)
+
             except Exception as e:
-                logger.error(f"处理转发队列时出错: {e}", exc_info=True)
+                logger.error("处理转发队列时出错: %s", e, exc_info=True)
                 if 'operator_id' in locals():
                     self.sendTextMsg(f"转发过程中发生错误: {str(e)}", operator_id)
             finally:
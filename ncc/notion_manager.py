@@ -1,6 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 import json
 import os
+import time
 from datetime import datetime
 from dataclasses import dataclass
 from notion_client import Client
@@ -9,21 +11,46 @@ from wcferry import Wcf
 from .db_manager import DatabaseManager
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.WARNING)
 
-# 创建控制台处理器
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.WARNING)
+# 模块可能被多次 import，只在第一次配置处理器，避免日志重复；
+# 级别可用环境变量覆盖，默认 WARNING
+if not logger.handlers:
+    _level = os.environ.get("NOTION_LOG_LEVEL", "WARNING").upper()
+    logger.setLevel(getattr(logging, _level, logging.WARNING))
 
-# 创建格式化器
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-console_handler.setFormatter(formatter)
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logger.level)
+    console_handler.setFormatter(
+        logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    )
+    logger.addHandler(console_handler)
 
-# 将处理器添加到日志记录器
-logger.addHandler(console_handler)
+    # 防止日志重复
+    logger.propagate = False
+
+def _title(props: Dict, key: str) -> str:
+    """取标题属性的纯文本，缺失时返回空串"""
+    items = props.get(key, {}).get('title')
+    return items[0]['text']['content'] if items else ''
+
+
+def _rich_text_first(props: Dict, key: str) -> Optional[str]:
+    """取富文本属性的第一段内容，缺失时返回 None"""
+    items = props.get(key, {}).get('rich_text')
+    return items[0]['text']['content'] if items else None
+
+
+def _checkbox(props: Dict, key: str) -> bool:
+    return bool(props.get(key, {}).get('checkbox', False))
+
+
+def _number(props: Dict, key: str) -> Optional[int]:
+    return props.get(key, {}).get('number')
+
+
+def _url(props: Dict, key: str) -> Optional[str]:
+    return props.get(key, {}).get('url')
 
-# 防止日志重复
-logger.propagate = False
 
 @dataclass
 class ForwardList:
@@ -57,81 +84,112 @@ class NotionManager:
         # 初始化数据库管理器
         self.db = DatabaseManager()
 
+        # 群聊 wxid -> 群名 的映射缓存：一次SQL取全量，代替逐个查Contact表
+        self._chatroom_map: Optional[Dict[str, str]] = None
+        self._chatroom_ts = 0.0
+        self._chatroom_sig = -1  # 群聊数量签名，没变就不做全量重载
+
+        # 解析好的转发列表缓存：数据只经 fetch_notion_data/_update_group_wxid
+        # 改动，写路径上失效即可，读路径不用重复查库重建对象
+        self._forward_lists_cache: Optional[List[ForwardList]] = None
+        # 由上面缓存派生的 list_id -> 群wxid列表 索引
+        self._groups_by_list: Optional[Dict[int, List[str]]] = None
+
+        # 最近一次写入 Notion 的群名，wxid -> name：系统通知可能重复触发，
+        # 名字没变就不再发 HTTP 请求
+        self._last_written: Dict[str, str] = {}
+
+    def _query_all(self, database_id: str) -> Dict:
+        """查询 Notion 数据库的全部记录，自动翻页
+
+        databases.query 单次最多返回100条，超出部分靠 next_cursor 续取；
+        返回和单次查询同构的 {'results': [...]}，调用方无需感知分页。
+        """
+        results = []
+        cursor = None
+        while True:
+            kwargs = {'database_id': database_id}
+            if cursor:
+                kwargs['start_cursor'] = cursor
+            response = self.notion.databases.query(**kwargs)
+            results.extend(response['results'])
+            if not response.get('has_more'):
+                break
+            cursor = response['next_cursor']
+        return {'results': results}
+
     def fetch_notion_data(self) -> bool:
         """从 Notion 获取原始数据并缓存到本地数据库"""
         try:
             logger.info("开始从 Notion 获取数据...")
             
-            # 获取所有列表数据
-            lists_response = self.notion.databases.query(database_id=self.lists_db_id)
-            
-            # 获取所有群组数据
-            groups_response = self.notion.databases.query(database_id=self.groups_db_id)
-
-            # 获取所有管理员数据
-            admins_response = self.notion.databases.query(database_id=self.admins_db_id)
-            
-            # 获取所有关键词数据
-            keywords_response = self.notion.databases.query(database_id=self.keywords_db_id)
+            # 四个库的数据互不依赖，并发拉取，总耗时从四次往返降到一次
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                futures = [
+                    executor.submit(self._query_all, db_id)
+                    for db_id in (
+                        self.lists_db_id,
+                        self.groups_db_id,
+                        self.admins_db_id,
+                        self.keywords_db_id,
+                    )
+                ]
+                # .result() 会重新抛出线程里的异常，统一走下面的 except 记录
+                lists_response, groups_response, admins_response, keywords_response = [
+                    f.result() for f in futures
+                ]
             
-            # 处理列表数据
+            # 处理列表数据，顺便建 页面id -> 分组编号 的索引：
+            # 群组解析关联时O(1)查表，且只收录通过校验的列表
             lists = []
+            page_to_list_id = {}
             for page in lists_response['results']:
-                list_id = page['properties'].get('分组编号', {}).get('number')
-                title = page['properties'].get('组名', {}).get('title', [])
-                description_texts = page['properties'].get('描述', {}).get('rich_text', [])
-                description = description_texts[0]['text']['content'] if description_texts else ''
+                props = page['properties']
+                list_id = _number(props, '分组编号')
+                list_name = _title(props, '组名')
                 
-                if list_id and title:
+                if list_id and list_name:
                     lists.append({
                         'list_id': list_id,
-                        'list_name': title[0]['text']['content'],
-                        'description': description
+                        'list_name': list_name,
+                        'description': _rich_text_first(props, '描述') or ''
                     })
-            
-            # 处理群组数据
+                    page_to_list_id[page['id']] = list_id
+
+            # 处理群组数据，顺便建 群组页面id -> wxid 的索引给关键词解析用
             groups = []
+            page_to_group_wxid = {}
             for page in groups_response['results']:
-                group_name = page['properties'].get('群名', {}).get('title', [{}])[0].get('text', {}).get('content', '')
-                wxid_texts = page['properties'].get('group_wxid', {}).get('rich_text', [])
-                wxid = wxid_texts[0]['text']['content'] if wxid_texts else None
-                welcome_enabled = bool(page['properties'].get('自定义迎新消息', {}).get('checkbox', False))
-                welcome_url = page['properties'].get('迎新推送链接（填写后视为开启）', {}).get('url')
-                allow_forward = bool(page['properties'].get('允许转发', {}).get('checkbox', False))
-                allow_speak = bool(page['properties'].get('允许发言', {}).get('checkbox', False))
+                props = page['properties']
+                group_name = _title(props, '群名')
+                wxid = _rich_text_first(props, 'group_wxid')
                 
                 if group_name and wxid:
+                    page_to_group_wxid[page['id']] = wxid
                     # 获取群组关联的列表ID
-                    relations = page['properties'].get('转发群聊分组', {}).get('relation', [])
+                    relations = props.get('转发群聊分组', {}).get('relation', [])
                     list_ids = []
-                    if relations:
-                        for relation in relations:
-                            relation_id = relation['id']
-                            # 查找对应的列表数据
-                            for list_data in lists_response['results']:
-                                if list_data['id'] == relation_id:
-                                    list_id = list_data['properties'].get('分组编号', {}).get('number')
-                                    if list_id is not None:
-                                        list_ids.append(list_id)
-                                    break
-                    
+                    for relation in relations:
+                        list_id = page_to_list_id.get(relation['id'])
+                        if list_id is not None:
+                            list_ids.append(list_id)
+
                     groups.append({
                         'wxid': wxid,
                         'name': group_name,
-                        'description': description,
-                        'welcome_enabled': welcome_enabled,
-                        'allow_forward': allow_forward,
-                        'allow_speak': allow_speak,
+                        'welcome_enabled': _checkbox(props, '自定义迎新消息'),
+                        'allow_forward': _checkbox(props, '允许转发'),
+                        'allow_speak': _checkbox(props, '允许发言'),
                         'list_ids': list_ids,
-                        'welcome_url': welcome_url
+                        'welcome_url': _url(props, '迎新推送链接（填写后视为开启）')
                     })
             
             # 处理管理员数据
             admins = []
             for page in admins_response['results']:
-                name = page['properties'].get('称呼', {}).get('title', [{}])[0].get('text', {}).get('content', '')
-                wxid_texts = page['properties'].get('wxid', {}).get('rich_text', [])
-                wxid = wxid_texts[0]['text']['content'] if wxid_texts else None
+                props = page['properties']
+                name = _title(props, '称呼')
+                wxid = _rich_text_first(props, 'wxid')
                 
                 if name and wxid:
                     admins.append({
@@ -143,77 +201,75 @@ class NotionManager:
             keywords = []
             for page in keywords_response['results']:
                 # 获取关键词（标题）
-                title = page['properties'].get('让对方回复', {}).get('title', [])
-                if not title:
+                keyword = _title(page['properties'], '让对方回复')
+                if not keyword:
                     continue
-                keyword = title[0]['text']['content']
                 
                 # 获取关联的群组
                 relations = page['properties'].get('拉入群聊', {}).get('relation', [])
                 if not relations:
                     continue
                 
-                # 遍历关联的群组，找到对应的wxid
+                # 通过索引找到关联群组的wxid
                 for relation in relations:
-                    relation_id = relation['id']
-                    # 在群组数据中查找对应的群组
-                    for group in groups_response['results']:
-                        if group['id'] == relation_id:
-                            wxid_texts = group['properties'].get('group_wxid', {}).get('rich_text', [])
-                            if wxid_texts:
-                                wxid = wxid_texts[0]['text']['content']
-                                keywords.append({
-                                    'keyword': keyword,
-                                    'group_id': wxid
-                                })
-            
-            # 更新数据库
-            self.db.update_forward_lists(lists)
-            self.db.update_groups(groups)
-            self.db.update_admins(admins)
-            self.db.update_keywords(keywords)
+                    wxid = page_to_group_wxid.get(relation['id'])
+                    if wxid:
+                        keywords.append({
+                            'keyword': keyword,
+                            'group_id': wxid
+                        })
             
+            # 更新数据库（四张表一个事务写完）
+            self.db.bulk_update(lists, groups, admins, keywords)
+
+            # 数据换了一轮，让读缓存立即失效
+            self.db.invalidate_cache()
+            self._forward_lists_cache = None
+            self._groups_by_list = None
+
             logger.info("成功更新本地数据库")
             return True
             
         except Exception as e:
-            logger.error(f"获取 Notion 数据失败: {e}", exc_info=True)
+            logger.error("获取 Notion 数据失败: %s", e, exc_info=True)
             return False
 
     def get_forward_lists_and_groups(self) -> List[ForwardList]:
-        """获取所有转发列表及其群组"""
+        """获取所有转发列表及其群组（结果缓存，写路径失效）"""
+        if self._forward_lists_cache is not None:
+            return self._forward_lists_cache
         try:
-            # 从数据库获取所有列表
+            # 聚合交给SQLite：每个列表一行，群组打包成JSON数组，
+            # 省去Python侧按 list_id 归组的循环
             with self.db.get_db() as conn:
                 cur = conn.cursor()
                 cur.execute('''
-                    SELECT l.list_id, l.list_name, g.wxid, g.name
+                    SELECT l.list_id, l.list_name,
+                           json_group_array(json_object('group_name', g.name, 'wxid', g.wxid))
                     FROM forward_lists l
                     LEFT JOIN group_lists gl ON l.list_id = gl.list_id
                     LEFT JOIN groups g ON gl.group_wxid = g.wxid
-                    ORDER BY l.list_id, g.name
+                    GROUP BY l.list_id, l.list_name
+                    ORDER BY l.list_id
                 ''')
                 rows = cur.fetchall()
             
-            lists = {}
-            for row in rows:
-                list_id, list_name, group_wxid, group_name = row
-                if list_id not in lists:
-                    lists[list_id] = ForwardList(
-                        list_id=list_id,
-                        list_name=list_name,
-                        groups=[]
-                    )
-                if group_wxid and group_name:  # 只添加有效的群组
-                    lists[list_id].groups.append({
-                        'group_name': group_name,
-                        'wxid': group_wxid
-                    })
-            
-            return list(lists.values())
+            result = []
+            for list_id, list_name, groups_json in rows:
+                # LEFT JOIN 没配上群组时数组里是一条全null的记录，过滤掉
+                groups = [g for g in json.loads(groups_json) if g['wxid']]
+                groups.sort(key=lambda g: g['group_name'])
+                result.append(ForwardList(
+                    list_id=list_id,
+                    list_name=list_name,
+                    groups=groups
+                ))
             
+            self._forward_lists_cache = result
+            return self._forward_lists_cache
+
         except Exception as e:
-            logger.error(f"获取列表失败: {e}", exc_info=True)
+            logger.error("获取列表失败: %s", e, exc_info=True)
             return []
 
     def _update_group_wxid(self, page_id: Optional[str], wxid: str, group_name: str) -> None:
@@ -224,6 +280,10 @@ class NotionManager:
             wxid: 微信群 ID
             group_name: 群名称
         """
+        if self._last_written.get(wxid) == group_name:
+            logger.info("群组 %s (%s) 未变化，跳过写入", group_name, wxid)
+            return
+
         try:
             properties = {
                 "群名": {
@@ -271,16 +331,63 @@ class NotionManager:
                 'welcome_url': None
             }])
             
-            logger.info(f"{'更新' if page_id else '创建'}群组: {group_name} ({wxid})")
+            # 本地群组数据变了，解析缓存跟着失效
+            self._forward_lists_cache = None
+            self._groups_by_list = None
+
+            self._last_written[wxid] = group_name
+            logger.info("%s群组: %s (%s)", "更新" if page_id else "创建", group_name, wxid)
             
         except Exception as e:
-            logger.error(f"{'更新' if page_id else '创建'}群组失败: {e}")
+            logger.error("%s群组失败: %s", "更新" if page_id else "创建", e)
+
+    def _chatroom_count(self) -> int:
+        """群聊数量，作为映射缓存的廉价失效签名"""
+        rows = self.wcf.query_sql(
+            "MicroMsg.db",
+            "SELECT COUNT(*) AS cnt FROM Contact WHERE UserName LIKE '%@chatroom';"
+        )
+        return rows[0]["cnt"] if rows else 0
+
+    def _load_chatroom_map(self) -> Dict[str, str]:
+        """加载群聊名称映射，带5分钟TTL缓存
+
+        TTL 到期后先查一次 COUNT 签名，群聊数量没变就只续期，
+        避免每5分钟都全量拉一遍 Contact 表。
+        """
+        now = time.monotonic()
+        if self._chatroom_map is not None and now - self._chatroom_ts <= 300:
+            return self._chatroom_map
+
+        sig = self._chatroom_count()
+        if self._chatroom_map is None or sig != self._chatroom_sig:
+            rows = self.wcf.query_sql(
+                "MicroMsg.db",
+                "SELECT UserName, NickName FROM Contact WHERE UserName LIKE '%@chatroom';"
+            )
+            self._chatroom_map = {row["UserName"]: row["NickName"] for row in (rows or [])}
+            self._chatroom_sig = sig
+        self._chatroom_ts = now
+        return self._chatroom_map
+
+    def get_chatroom_name(self, wxid: str) -> Optional[str]:
+        """查群聊名称；刚加入的群可能不在缓存里，miss时强制刷新一次"""
+        name = self._load_chatroom_map().get(wxid)
+        if name is None:
+            self._chatroom_ts = 0.0
+            name = self._load_chatroom_map().get(wxid)
+        return name
 
     def get_groups_by_list_id(self, list_id: int) -> List[str]:
-        """获取指定列表ID的所有群组wxid"""
-        return self.db.get_groups_by_list_id(list_id)
+        """获取指定列表ID的所有群组wxid（查派生索引，不再每次跑SQL）"""
+        if self._groups_by_list is None:
+            self._groups_by_list = {
+                lst.list_id: [g['wxid'] for g in lst.groups]
+                for lst in self.get_forward_lists_and_groups()
+            }
+        return self._groups_by_list.get(list_id, [])
 
-    def get_admins_wxid(self) -> List[str]:
+    def get_admins_wxid(self) -> frozenset:
         """获取所有管理员的wxid"""
         return self.db.get_admin_wxids()
 
@@ -302,6 +409,6 @@ class NotionManager:
             self._update_group_wxid(None, wxid, group_name)
             return True
         except Exception as e:
-            logger.error(f"创建/更新群组失败: {e}", exc_info=True)
+            logger.error("创建/更新群组失败: %s", e, exc_info=True)
             return False
 
@@ -14,6 +14,14 @@ from .db_manager import DatabaseManager
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 迎新管理菜单是固定文案，构建一次即可
+_WELCOME_MENU = (
+    "迎新消息管理：\n"
+    "1 👈 查看当前迎新消息\n"
+    "2 👈 设置新的迎新消息\n"
+    "0 👈 退出"
+)
+
 class WelcomeService:
     def __init__(self, wcf):
         self.wcf = wcf
@@ -22,16 +30,37 @@ class WelcomeService:
             r"(.+)通过扫描二维码加入群聊",
         ]
         self.db = DatabaseManager()
+        # 消息类型 -> 发送方法 的分发表，查看和迎新推送共用
+        self._type_senders = {
+            1: self._send_text_message,     # 文本消息
+            3: self._send_image_message,    # 图片消息
+            49: self._send_record_message,  # 合并转发消息
+        }
+
+    def _send_saved_message(self, msg: Dict, receiver: str, member_name: str = None) -> None:
+        """按消息类型发送一条已保存的迎新消息"""
+        sender = self._type_senders.get(msg["type"])
+        if sender:
+            sender(msg, receiver, member_name)
+
+    def _send_text_message(self, msg: Dict, receiver: str, member_name: str = None) -> None:
+        content = msg["content"]
+        if member_name is not None:
+            # 替换消息中的 {member_name} 为实际昵称
+            content = content.replace("{member_name}", member_name)
+        self.wcf.send_text(content, receiver)
+
+    def _send_image_message(self, msg: Dict, receiver: str, member_name: str = None) -> None:
+        if msg.get("extra"):  # 如果有图片路径
+            self.wcf.send_image(msg["extra"], receiver)
+
+    def _send_record_message(self, msg: Dict, receiver: str, member_name: str = None) -> None:
+        if msg.get("extra"):  # 如果有recorditem
+            self._send_merged_msg(msg["extra"], receiver)
 
     def show_menu(self, operator: str) -> None:
         """显示迎新消息管理菜单"""
-        menu = (
-            "迎新消息管理：\n"
-            "1 👈 查看当前迎新消息\n"
-            "2 👈 设置新的迎新消息\n"
-            "0 👈 退出"
-        )
-        self.wcf.send_text(menu, operator)
+        self.wcf.send_text(_WELCOME_MENU, operator)
 
     def show_current_messages(self, group_id: str, operator: str) -> None:
         """显示当前迎新消息"""
@@ -42,14 +71,7 @@ class WelcomeService:
 
         # 发送所有消息
         for msg in messages:
-            if msg["type"] == 1:  # 文本消息
-                self.wcf.send_text(msg["content"], operator)
-            elif msg["type"] == 3:  # 图片消息
-                if msg.get("extra"):  # 如果有图片路径
-                    self.wcf.send_image(msg["extra"], operator)
-            elif msg["type"] == 49:  # 合并转发消息
-                if msg.get("extra"):  # 如果有recorditem
-                    self._send_merged_msg(msg["extra"], operator)
+            self._send_saved_message(msg, operator)
 
         # 获取最后一次更新的时间和操作者
         with self.db.get_db() as conn:
@@ -175,18 +197,8 @@ class WelcomeService:
                 time.sleep(delay)
                 # 发送每条消息
                 for msg in messages:
+                    self._send_saved_message(msg, group_id, member_name)
 
-                    if msg["type"] == 1:  # 文本消息
-                        # 替换消息中的 {member_name} 为实际昵称
-                        content = msg["content"].replace("{member_name}", member_name)
-                        self.wcf.send_text(content, group_id)
-                    elif msg["type"] == 3:  # 图片消息
-                        if msg.get("extra"):  # 如果有图片路径
-                            self.wcf.send_image(msg["extra"], group_id)
-                    elif msg["type"] == 49:  # 合并转发消息
-                        if msg.get("extra"):  # 如果有recorditem
-                            self._send_merged_msg(msg["extra"], group_id)
-                    
                     # 每条消息之间随机延迟1-3秒
                     time.sleep(random.uniform(1, 3))
 
@@ -240,13 +240,9 @@ class Robot:
                     
                     # 2. 检测新群邀请
                     elif re.search(r".*邀请你加入了群聊", msg.content):
-                        # 获取群名称
-                        group_info = self.wcf.query_sql(
-                            "MicroMsg.db",
-                            f"SELECT NickName FROM Contact WHERE UserName='{msg.roomid}';"
-                        )
-                        if group_info and len(group_info) > 0:
-                            group_name = group_info[0]["NickName"]
+                        # 获取群名称（走 NotionManager 的群聊名称缓存，miss时自动刷新）
+                        group_name = self.notion_manager.get_chatroom_name(msg.roomid)
+                        if group_name:
                             # 创建新群组记录
                             self.notion_manager.create_new_group(msg.roomid, group_name)
                             # 发送飞书通知
@@ -519,9 +515,17 @@ class Robot:
         """
         # 先更新 Notion 数据到数据库
         self.notion_manager.fetch_notion_data()
+        # 让NCC管理器的转发列表/群组缓存立即失效，
+        # 否则"*更新"之后的转发还会按旧的群组集合发
+        self.ncc_manager._invalidate_lists_cache()
+        # 各组件持有独立的 DatabaseManager 实例和读缓存，迎新服务的
+        # 也要失效，下面的 load_groups_from_local 才能读到新数据
+        self.welcome_service.db.invalidate_cache()
         # 然后更新内存中的群组列表
         speak_enabled_groups = self.db.get_speak_enabled_groups()
         self.allowed_groups = [group['wxid'] for group in speak_enabled_groups]
         # 更新欢迎服务的群组配置
         self.welcome_service.load_groups_from_local()
+        # 更新关键词邀请的内存索引
+        self.invite_service.refresh_keywords()
         self.LOG.info("已更新配置和数据")